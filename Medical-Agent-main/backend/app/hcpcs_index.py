@@ -0,0 +1,183 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+import logging
+import pickle
+import re
+
+from numba import njit
+import numpy as np
+import orjson
+
+logger = logging.getLogger(__name__)
+
+ASSETS_DIR = Path(__file__).resolve().parent.parent.parent / "assets"
+JSON_PATH = ASSETS_DIR / "ucsf_standard_charges.json"
+INDEX_PATH = ASSETS_DIR / "hcpcs_index.pkl"
+# Bump when the layout returned by build_hcpcs_index changes so stale pickles are rebuilt
+INDEX_VERSION = 5
+
+# Care settings in the CMS price transparency schema; 'both' charges apply to either
+CHARGE_SETTINGS = ('inpatient', 'outpatient', 'both')
+
+COMMON_WORDS = {'the', 'a', 'an', 'and', 'or', 'for', 'with', 'of', 'in', 'to', 'from'}
+
+
+def extract_keywords(text: str) -> Set[str]:
+    """Extract meaningful keywords (4+ letter words, minus common words) from a description."""
+    return set(re.findall(r"[a-z]{4,}", text.lower())) - COMMON_WORDS
+
+
+def _charge_info(charge: Dict) -> Dict:
+    """Keep only the charge fields reported by lookups, with amounts as floats."""
+    gross_charge = charge.get('gross_charge')
+    discounted_cash = charge.get('discounted_cash')
+    return {
+        'gross_charge': float(gross_charge) if gross_charge is not None else None,
+        'discounted_cash': float(discounted_cash) if discounted_cash is not None else None,
+        'setting': charge.get('setting'),
+        'billing_class': charge.get('billing_class'),
+        'modifiers': charge.get('modifiers'),
+    }
+
+
+def build_hcpcs_index(data: Dict) -> Dict[str, Any]:
+    """
+    Index UCSF standard charges data by HCPCS code.
+    Returns the per-code database plus the columnar arrays used for similar-code
+    search, which only cover codes with a priced charge (row i of each array
+    describes the same code). Each description is
+    tokenized into keyword ids stored as a CSR matrix: the ids of row i are
+    tokens_flat[tokens_offsets[i]:tokens_offsets[i + 1]]. The transposed matrix
+    holds the posting lists: the rows containing keyword id k are
+    postings_flat[postings_offsets[k]:postings_offsets[k + 1]].
+
+    Each database entry carries its charges trimmed to the reported fields and
+    sorted by gross charge, the same list pre-filtered per setting and per billing
+    class, and its precomputed min_price (inf when unpriced) and max_price.
+    """
+    database: Dict[str, Dict] = {}
+
+    # Index by HCPCS code for fast lookups
+    for entry in data.get('standard_charge_information', []):
+        codes = entry.get('code_information', [])
+        for code_info in codes:
+            if code_info.get('type') == 'HCPCS':
+                code = code_info.get('code')
+                if code:
+                    # Store the first occurrence (can be enhanced to store all)
+                    if code not in database:
+                        database[code] = {
+                            'description': entry.get('description'),
+                            'code': code,
+                            'standard_charges': entry.get('standard_charges', []),
+                            'revenue_code': next((c.get('code') for c in codes if c.get('type') == 'RC'), None)
+                        }
+
+    # Precompute sorted and pre-filtered charge lists and price bounds per code
+    for entry in database.values():
+        charges = sorted(
+            (_charge_info(c) for c in entry['standard_charges']),
+            key=lambda c: (c['gross_charge'] is None, c['gross_charge'])
+        )
+        entry['standard_charges'] = charges
+        entry['charges_by_setting'] = {
+            setting: [c for c in charges if c['setting'] in ('both', setting)]
+            for setting in CHARGE_SETTINGS
+        }
+        charges_by_billing_class: Dict[str, List[Dict]] = {}
+        for c in charges:
+            charges_by_billing_class.setdefault(c['billing_class'], []).append(c)
+        entry['charges_by_billing_class'] = charges_by_billing_class
+
+        gross_charges = [c['gross_charge'] for c in charges if c['gross_charge']]
+        entry['min_price'] = gross_charges[0] if gross_charges else float('inf')
+        entry['max_price'] = gross_charges[-1] if gross_charges else None
+
+    # Build the columnar arrays and tokenized descriptions; unpriced codes can
+    # never be a cheaper alternative, so they are left out of the search arrays
+    entries = [e for e in database.values() if e['min_price'] != float('inf')]
+    vocab: Dict[str, int] = {}
+    tokens: List[int] = []
+    offsets = [0]
+    for entry in entries:
+        for keyword in sorted(extract_keywords(entry.get('description') or '')):
+            tokens.append(vocab.setdefault(keyword, len(vocab)))
+        offsets.append(len(tokens))
+
+    # Transpose into posting lists (rows stay ascending within each keyword)
+    tokens_flat = np.array(tokens, dtype=np.int32)
+    token_rows = np.repeat(np.arange(len(entries), dtype=np.int32), np.diff(offsets))
+    postings_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tokens_flat, minlength=len(vocab)), out=postings_offsets[1:])
+
+    return {
+        'version': INDEX_VERSION,
+        'database': database,
+        'codes': np.array([e['code'] for e in entries], dtype=str),
+        'descriptions': np.array([e.get('description') for e in entries], dtype=object),
+        'revenue_codes': np.array([e.get('revenue_code') for e in entries], dtype=object),
+        'min_prices': np.array([e['min_price'] for e in entries], dtype=np.float64),
+        'vocab': vocab,
+        'tokens_flat': tokens_flat,
+        'tokens_offsets': np.array(offsets, dtype=np.int64),
+        'postings_flat': token_rows[np.argsort(tokens_flat, kind='stable')],
+        'postings_offsets': postings_offsets,
+    }
+
+
+def build_hcpcs_index_from_json(json_path: Path = JSON_PATH) -> Dict[str, Any]:
+    """Parse the UCSF standard charges JSON and index it."""
+    return build_hcpcs_index(orjson.loads(json_path.read_bytes()))
+
+
+def save_hcpcs_index(index: Dict[str, Any], index_path: Path = INDEX_PATH) -> None:
+    with open(index_path, 'wb') as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_prebuilt_hcpcs_index(
+    index_path: Path = INDEX_PATH, json_path: Path = JSON_PATH
+) -> Optional[Dict[str, Any]]:
+    """
+    Load the pre-built index written by tools/build_hcpcs_index.py.
+    Returns None if it is missing, older than the source JSON, unreadable or
+    outdated, so the caller falls back to indexing the JSON.
+    """
+    if not index_path.exists():
+        return None
+    if json_path.exists() and index_path.stat().st_mtime < json_path.stat().st_mtime:
+        logger.warning(f"Pre-built HCPCS index at {index_path} is older than {json_path}, ignoring it")
+        return None
+
+    try:
+        with open(index_path, 'rb') as f:
+            index = pickle.load(f)
+    except Exception as e:
+        # Corrupt file, or pickled by incompatible library versions (e.g. numpy)
+        logger.warning(f"Could not load pre-built HCPCS index at {index_path}, ignoring it: {e}")
+        return None
+    if not isinstance(index, dict) or index.get('version') != INDEX_VERSION:
+        logger.warning(f"Pre-built HCPCS index at {index_path} has an outdated layout, ignoring it")
+        return None
+    return index
+
+
+@njit("void(int32[:], int64[:], int32[:], int32[:], float64[:], float64, int32[:])", cache=True)
+def score_similar_rows(tokens_flat, tokens_offsets, query_ids, rows, min_prices, max_price, out_scores):
+    """
+    Count how many of the (unique) query keyword ids each of the given rows contains.
+    Rows priced at or above max_price score 0.
+    Runs single-threaded: it is called from concurrent worker threads and only
+    scans a few hundred candidate rows per query.
+    """
+    for i in range(len(rows)):
+        row = rows[i]
+        score = 0
+        if min_prices[row] < max_price:
+            for j in range(tokens_offsets[row], tokens_offsets[row + 1]):
+                token = tokens_flat[j]
+                for query_id in query_ids:
+                    if token == query_id:
+                        score += 1
+                        break
+        out_scores[i] = score
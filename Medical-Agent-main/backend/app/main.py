@@ -1,14 +1,34 @@
+from contextlib import asynccontextmanager
 from enum import Enum
 from pathlib import Path
-from typing import Dict, List, Optional
-import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import functools
+import hashlib
 import logging
+import math
+import os
+import re
 
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, NotFoundError
+from pydantic import BaseModel, ValidationError
 from dotenv import load_dotenv
+import httpx
+import numpy as np
+import orjson
+
+from app.hcpcs_index import (
+    INDEX_PATH,
+    JSON_PATH,
+    build_hcpcs_index_from_json,
+    extract_keywords,
+    load_prebuilt_hcpcs_index,
+    score_similar_rows,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -41,13 +61,27 @@ class CodeValidation(BaseModel):
     reasoning: str
 
 
+class RuleValidation(CodeValidation):
+    # Number of leading lines of the code that stay accepted when the rest are disputed
+    # (e.g. the legitimately billed lines of a duplicated code)
+    accepted_lines: int = 0
+
+
 class ValidationResponse(BaseModel):
     validations: List[CodeValidation]
     overall_reasoning: str
 
 
-class AppealDraftResponse(BaseModel):
-    appeal_draft: str
+class BatchExtraction(BaseModel):
+    results: List[HCPCSExtraction]
+
+
+class BatchValidationResponse(BaseModel):
+    results: List[ValidationResponse]
+
+
+class BatchAppealDraftResponse(BaseModel):
+    appeal_drafts: List[str]
 
 
 class CodeAnalysis(BaseModel):
@@ -66,7 +100,20 @@ class AnalyzeResponse(BaseModel):
     overall_reasoning: str
 
 
-app = FastAPI()
+class AnalyzeBatchResponse(BaseModel):
+    results: List[AnalyzeResponse] = []
+    batch_id: Optional[str] = None  # Set when submitted to the OpenAI Batch API
+    batch_status: Optional[str] = None  # OpenAI Batch API status when polling a batch id
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close the pooled OpenAI connections on shutdown
+    await http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Add CORS middleware to allow frontend requests
 app.add_middleware(
@@ -79,43 +126,71 @@ app.add_middleware(
 
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path, override=False)
-client = OpenAI()
+
+# One HTTP/2 connection pool shared by every OpenAI call, so requests reuse
+# warm TLS connections instead of paying a handshake per call
+http_client = DefaultAsyncHttpxClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+    timeout=httpx.Timeout(300.0, connect=10.0),
+)
+client = AsyncOpenAI(http_client=http_client)
+
+# Completed /bill/analyze results by bill hash, so re-submitted bills (page
+# refreshes, retries) skip the LLM pipeline; set ANALYZE_CACHE_ENABLED=false to disable
+ANALYZE_CACHE_ENABLED = os.getenv("ANALYZE_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+ANALYZE_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=3600)
 
 # Load UCSF standard charges database for HCPCS code lookups
 HCPCS_DATABASE: Dict[str, Dict] = {}
 
+# Columnar (struct-of-arrays) copy of the priced codes for similar-code search;
+# row i of each array describes the same code
+CODES = np.array([], dtype=str)
+DESCRIPTIONS = np.array([], dtype=object)
+REVENUE_CODES = np.array([], dtype=object)
+MIN_PRICES = np.array([], dtype=np.float64)
+# Cheapest standard charge in the database; nothing can undercut a price at or below it
+GLOBAL_MIN_PRICE = float('inf')
+
+# Keyword -> id, each row's description keyword ids and each keyword's posting list (CSR layout)
+TOKEN_VOCAB: Dict[str, int] = {}
+TOKENS_FLAT = np.array([], dtype=np.int32)
+TOKENS_OFFSETS = np.zeros(1, dtype=np.int64)
+POSTINGS_FLAT = np.array([], dtype=np.int32)
+POSTINGS_OFFSETS = np.zeros(1, dtype=np.int64)
+
+
 def load_hcpcs_database():
-    """Load UCSF standard charges JSON and index by HCPCS codes."""
-    global HCPCS_DATABASE
-    assets_path = Path(__file__).resolve().parent.parent.parent / "assets" / "ucsf_standard_charges.json"
-    
-    logger.info(f"Loading HCPCS database from {assets_path}")
-    
-    if not assets_path.exists():
-        logger.warning(f"HCPCS database not found at {assets_path}")
-        return
+    """Load the HCPCS index, preferring the pre-built pickle over parsing the UCSF JSON."""
+    global HCPCS_DATABASE, CODES, DESCRIPTIONS, REVENUE_CODES, MIN_PRICES, GLOBAL_MIN_PRICE
+    global TOKEN_VOCAB, TOKENS_FLAT, TOKENS_OFFSETS, POSTINGS_FLAT, POSTINGS_OFFSETS
     
     try:
-        with open(assets_path, 'r') as f:
-            data = json.load(f)
-        
-        logger.info(f"Parsing HCPCS codes from JSON data...")
+        index = load_prebuilt_hcpcs_index()
+        if index is not None:
+            logger.info(f"Loaded pre-built HCPCS index from {INDEX_PATH}")
+        else:
+            logger.info(f"Loading HCPCS database from {JSON_PATH}")
+            
+            if not JSON_PATH.exists():
+                logger.warning(f"HCPCS database not found at {JSON_PATH}")
+                return
+            
+            logger.info(f"Parsing HCPCS codes from JSON data...")
+            index = build_hcpcs_index_from_json()
         
-        # Index by HCPCS code for fast lookups
-        for entry in data.get('standard_charge_information', []):
-            codes = entry.get('code_information', [])
-            for code_info in codes:
-                if code_info.get('type') == 'HCPCS':
-                    code = code_info.get('code')
-                    if code:
-                        # Store the first occurrence (can be enhanced to store all)
-                        if code not in HCPCS_DATABASE:
-                            HCPCS_DATABASE[code] = {
-                                'description': entry.get('description'),
-                                'code': code,
-                                'standard_charges': entry.get('standard_charges', []),
-                                'revenue_code': next((c.get('code') for c in codes if c.get('type') == 'RC'), None)
-                            }
+        HCPCS_DATABASE = index['database']
+        CODES = index['codes']
+        DESCRIPTIONS = index['descriptions']
+        REVENUE_CODES = index['revenue_codes']
+        MIN_PRICES = index['min_prices']
+        GLOBAL_MIN_PRICE = float(MIN_PRICES.min()) if len(MIN_PRICES) else float('inf')
+        TOKEN_VOCAB = index['vocab']
+        TOKENS_FLAT = index['tokens_flat']
+        TOKENS_OFFSETS = index['tokens_offsets']
+        POSTINGS_FLAT = index['postings_flat']
+        POSTINGS_OFFSETS = index['postings_offsets']
         
         logger.info(f"✓ Successfully loaded {len(HCPCS_DATABASE)} HCPCS codes from UCSF database")
     except Exception as e:
@@ -125,10 +200,12 @@ def load_hcpcs_database():
 load_hcpcs_database()
 
 
+@functools.lru_cache(maxsize=8192)
 def lookup_hcpcs_code(code: str, setting: Optional[str] = None, billing_class: Optional[str] = None) -> Dict:
     """
     Look up a HCPCS code in the UCSF standard charges database.
     Returns pricing information and metadata for the code.
+    Results are cached (the database is read-only after startup), so callers must not mutate them.
     """
     logger.info(f"🔍 Looking up code '{code}'...")
     
@@ -141,33 +218,28 @@ def lookup_hcpcs_code(code: str, setting: Optional[str] = None, billing_class: O
         }
     
     entry = HCPCS_DATABASE[code]
-    charges = entry.get('standard_charges', [])
+    charges = entry['standard_charges']
     
     logger.info(f"  ✓ Found code '{code}': {entry.get('description', 'No description')[:60]}...")
     
-    # Filter charges by setting and billing_class if provided
+    # Filter charges by setting and billing_class if provided (lists are pre-filtered at load)
     filtered_charges = charges
+    if setting:
+        charges_by_setting = entry['charges_by_setting']
+        filtered_charges = charges_by_setting.get(setting, charges_by_setting['both'])
+    if billing_class:
+        if setting:
+            filtered_charges = [c for c in filtered_charges if c['billing_class'] == billing_class]
+        else:
+            filtered_charges = entry['charges_by_billing_class'].get(billing_class, [])
     if setting or billing_class:
-        filtered_charges = [
-            c for c in charges
-            if (not setting or c.get('setting') in ['both', setting]) and
-               (not billing_class or c.get('billing_class') == billing_class)
-        ]
         logger.info(f"  Filtered {len(charges)} charges → {len(filtered_charges)} matching charges")
     
-    # Extract charge amounts
-    charge_info = []
-    for charge in filtered_charges[:5]:  # Limit to first 5 matches
-        charge_info.append({
-            'gross_charge': charge.get('gross_charge'),
-            'discounted_cash': charge.get('discounted_cash'),
-            'setting': charge.get('setting'),
-            'billing_class': charge.get('billing_class'),
-            'modifiers': charge.get('modifiers'),
-        })
+    # Charges are sorted by gross charge, so these are the 5 cheapest matches
+    charge_info = filtered_charges[:5]
     
     if charge_info:
-        logger.info(f"  Standard charges: ${charge_info[0].get('gross_charge', 'N/A')} gross, ${charge_info[0].get('discounted_cash', 'N/A')} discounted")
+        logger.info(f"  Standard charges: ${charge_info[0]['gross_charge']} gross, ${charge_info[0]['discounted_cash']} discounted")
     
     return {
         "found": True,
@@ -175,67 +247,132 @@ def lookup_hcpcs_code(code: str, setting: Optional[str] = None, billing_class: O
         "description": entry.get('description'),
         "revenue_code": entry.get('revenue_code'),
         "standard_charges": charge_info,
-        "num_charge_variants": len(charges)
+        "num_charge_variants": len(charges),
+        # Lowest and highest gross charge across all variants, not just the ones listed above
+        "min_gross_charge": entry['min_price'] if math.isfinite(entry['min_price']) else None,
+        "max_gross_charge": entry['max_price']
     }
 
 
 def find_similar_cheaper_codes(description: str, max_price: float, limit: int = 5) -> List[Dict]:
     """
     Search for codes with similar descriptions that cost less than max_price.
-    Uses keyword extraction and matching against the HCPCS database.
+    Uses keyword extraction and the inverted keyword index of the HCPCS database.
     """
-    if not description:
+    # Two 4+ letter keywords need at least 9 characters, nothing is cheaper than the
+    # cheapest code in the database, and a non-finite price can't be bucketed
+    if not description or len(description) < 8 or max_price <= GLOBAL_MIN_PRICE:
+        return []
+    if not math.isfinite(max_price):
         return []
     
-    # Extract meaningful keywords (remove common words)
-    common_words = {'the', 'a', 'an', 'and', 'or', 'for', 'with', 'of', 'in', 'to', 'from'}
-    keywords = [
-        word.lower() for word in description.split() 
-        if len(word) > 3 and word.lower() not in common_words
-    ]
+    # Round the price down to whole dollars so repeated charges share cache entries;
+    # rounding down keeps every result strictly cheaper than max_price
+    return list(_search_similar_codes(description, math.floor(max_price), limit))
+
+
+def top_k_by_score_and_price(scores: np.ndarray, prices: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k best entries by score (descending), then price (ascending), then index, in rank order.
+    Selects them in linear time with partitioning and sorts only those k, instead of sorting everything;
+    the result is the same as np.lexsort((prices, -scores))[:k].
+    """
+    if len(scores) > k > 0:
+        # Everything scoring above the k-th best score makes the cut; the remaining
+        # slots go to the cheapest entries tied at that score, lowest index first
+        kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth_score)
+        tied = np.flatnonzero(scores == kth_score)
+        n_tied = k - len(above)
+        if n_tied < len(tied):
+            tied_prices = prices[tied]
+            kth_price = np.partition(tied_prices, n_tied - 1)[n_tied - 1]
+            cheaper = tied[tied_prices < kth_price]
+            at_kth_price = tied[tied_prices == kth_price][:n_tied - len(cheaper)]
+            tied = np.concatenate([cheaper, at_kth_price])
+        selected = np.concatenate([above, tied])
+    else:
+        selected = np.arange(len(scores))[:k]
+    return selected[np.lexsort((selected, prices[selected], -scores[selected]))]
+
+
+@functools.lru_cache(maxsize=2048)
+def _search_similar_codes(description: str, max_price_bucket: int, limit: int) -> Tuple[Dict, ...]:
+    keywords = extract_keywords(description)
+    # A match needs at least 2 shared keywords
+    if len(keywords) < 2:
+        return ()
     
-    if not keywords:
-        return []
+    logger.info(f"  🔎 Searching for similar codes with keywords: {sorted(keywords)[:5]}")
     
-    logger.info(f"  🔎 Searching for similar codes with keywords: {keywords[:5]}")
+    # Order keywords from rarest to most common by posting list length
+    query_ids = np.array(
+        sorted(
+            (TOKEN_VOCAB[k] for k in keywords if k in TOKEN_VOCAB),
+            key=lambda k: POSTINGS_OFFSETS[k + 1] - POSTINGS_OFFSETS[k]
+        ),
+        dtype=np.int32
+    )
+    if len(query_ids) < 2:
+        return ()
     
-    # Search through database for similar descriptions
-    similar_codes = []
-    for code, entry in HCPCS_DATABASE.items():
-        entry_desc = entry.get('description', '').lower()
-        
-        # Count keyword matches
-        matches = sum(1 for keyword in keywords if keyword in entry_desc)
-        if matches < 2:  # Require at least 2 keyword matches
-            continue
-        
-        # Get the minimum price for this code
-        charges = entry.get('standard_charges', [])
-        if not charges:
-            continue
-        
-        min_price = min(
-            (float(c.get('gross_charge', float('inf'))) for c in charges if c.get('gross_charge')),
-            default=float('inf')
-        )
-        
-        # Only include if cheaper than the billed price
-        if min_price < max_price:
-            similar_codes.append({
-                'code': code,
-                'description': entry.get('description'),
-                'min_price': min_price,
-                'match_score': matches,
-                'revenue_code': entry.get('revenue_code')
-            })
+    # A code with at least 2 of the k keywords must contain one of the k - 1 rarest,
+    # so only their posting lists need to be scanned for candidates
+    candidate_rows = np.unique(np.concatenate([
+        POSTINGS_FLAT[POSTINGS_OFFSETS[k]:POSTINGS_OFFSETS[k + 1]] for k in query_ids[:-1]
+    ]))
     
-    # Sort by match score (descending) and price (ascending)
-    similar_codes.sort(key=lambda x: (-x['match_score'], x['min_price']))
+    # Count keyword matches per candidate for codes cheaper than the billed price (JIT-compiled)
+    match_scores = np.empty(len(candidate_rows), dtype=np.int32)
+    score_similar_rows(
+        TOKENS_FLAT, TOKENS_OFFSETS, query_ids, candidate_rows,
+        MIN_PRICES, float(max_price_bucket), match_scores
+    )
     
-    if similar_codes:
-        logger.info(f"  ✓ Found {len(similar_codes)} similar cheaper codes")
+    # Require at least 2 keyword matches
+    is_match = match_scores >= 2
+    candidates = candidate_rows[is_match]
+    match_scores = match_scores[is_match]
     
-    return similar_codes[:limit]
+    if len(candidates):
+        logger.info(f"  ✓ Found {len(candidates)} similar cheaper codes")
+    
+    # Rank by match score (descending) and price (ascending), sorting only the top `limit`
+    top = top_k_by_score_and_price(match_scores, MIN_PRICES[candidates], limit)
+    
+    return tuple(
+        {
+            'code': str(CODES[row]),
+            'description': DESCRIPTIONS[row],
+            'min_price': float(MIN_PRICES[row]),
+            'match_score': int(score),
+            'revenue_code': REVENUE_CODES[row]
+        }
+        for row, score in zip(candidates[top], match_scores[top])
+    )
+
+
+def clear_lookup_caches() -> None:
+    """Clear the memoized code lookups and similar-code searches (e.g. after reloading the database)."""
+    lookup_hcpcs_code.cache_clear()
+    _search_similar_codes.cache_clear()
+
+
+# Frequently billed codes (ED/office visits, venipuncture, common labs, chest X-ray, ECG)
+COMMON_HCPCS_CODES = (
+    "99283", "99284", "99285", "99213", "99214", "36415",
+    "85025", "80053", "80048", "81001", "71046", "93005",
+)
+
+
+def warm_lookup_cache() -> None:
+    """Pre-populate the lookup cache with the most commonly billed codes."""
+    for code in COMMON_HCPCS_CODES:
+        lookup_hcpcs_code(code)
+    logger.info(f"✓ Warmed lookup cache with {len(COMMON_HCPCS_CODES)} common HCPCS codes")
+
+
+warm_lookup_cache()
 
 
 @app.get("/")
@@ -243,29 +380,126 @@ def read_root():
     return {"message": "Hello, FastAPI!"}
 
 
-def extract_hcpcs_codes(payload: AnalyzeRequest) -> List[HCPCSCode]:
+EXTRACTION_SYSTEM_PROMPT = (
+    "You are a medical coding assistant. Extract HCPCS/CPT codes from the "
+    "provided bill text. HCPCS codes include CPT codes (numeric codes for procedures) "
+    "and other codes for supplies, drugs, and services. Return null values when information is missing."
+)
+
+VALIDATION_SYSTEM_PROMPT = (
+    "You are a medical billing auditor analyzing HCPCS/CPT codes. "
+    "Each code includes:\n"
+    "1. Billed charge from the patient's bill\n"
+    "2. Standard pricing from UCSF database (if available)\n"
+    "3. Cheaper alternative codes with similar descriptions (if found)\n\n"
+    "Your task:\n"
+    "- Mark codes as 'disputed' if:\n"
+    "  * Billed charge significantly exceeds standard charges (upcoding)\n"
+    "  * A cheaper alternative with similar description exists (wrong code used)\n"
+    "  * The code is duplicated inappropriately\n"
+    "  * Medical necessity is questionable based on after-care summary\n"
+    "- Mark codes as 'accepted' if they appear valid\n"
+    "- Provide specific, factual reasoning citing prices and alternatives"
+)
+
+APPEAL_SYSTEM_PROMPT = (
+    "You are a professional medical billing advocate drafting an appeal letter.\n\n"
+    "Draft a formal, professional appeal letter that:\n"
+    "- Is addressed to the billing department\n"
+    "- Clearly identifies the patient and bill details from the provided bill\n"
+    "- Lists each disputed code with specific, factual reasoning\n"
+    "- Requests formal review and adjustment of the disputed charges\n"
+    "- Maintains a professional, respectful, yet firm tone\n"
+    "- Cites medical billing standards and regulations where appropriate\n"
+    "- Includes a clear call to action and contact information placeholder"
+)
+
+
+def batch_system_prompt(system_prompt: str, num_bills: int) -> str:
+    """Extend a single-bill system prompt with instructions for a batched request."""
+    return (
+        f"{system_prompt}\n\n"
+        f"The input contains {num_bills} bills, each starting with 'Bill N:' and separated by '###'. "
+        "Handle each bill independently and return exactly one result per bill, in the same order."
+    )
+
+
+def join_bill_sections(sections: List[str]) -> str:
+    """Combine per-bill prompt sections into a single batched prompt."""
+    return "\n###\n".join(
+        f"Bill {index}:\n{section}" for index, section in enumerate(sections, start=1)
+    )
+
+
+def format_extraction_input(payload: AnalyzeRequest) -> str:
+    return (
+        "Bill text:\n"
+        f"{payload.bill}\n\n"
+        f"After-care summary: {payload.after_care_summary}"
+    )
+
+
+def format_validation_input(payload: AnalyzeRequest, codes_with_pricing: List[Dict]) -> str:
+    return (
+        f"Bill text:\n{payload.bill}\n\n"
+        f"After-care summary: {payload.after_care_summary or 'None provided'}\n\n"
+        f"Codes with pricing data:\n{orjson.dumps(codes_with_pricing).decode()}"
+    )
+
+
+def format_appeal_input(
+    payload: AnalyzeRequest,
+    disputed_codes: List[CodeAnalysis],
+    overall_reasoning: str,
+    disputed_amount: float
+) -> str:
+    # Prepare disputed codes information
+    disputed_info = []
+    for code in disputed_codes:
+        disputed_info.append({
+            "code": code.code,
+            "description": code.description,
+            "charge": code.billed_charge,
+            "reasoning": code.reasoning
+        })
+    
+    return (
+        f"Bill text:\n{payload.bill}\n\n"
+        f"After-care summary: {payload.after_care_summary or 'None provided'}\n\n"
+        f"Overall analysis: {overall_reasoning}\n\n"
+        f"Disputed codes ({len(disputed_codes)} total, ${disputed_amount:,.2f}):\n{disputed_info}"
+    )
+
+
+# Most bills combined into one batched prompt; larger batches are split into groups
+# so prompts and structured outputs stay within the model's context and output limits
+MAX_BILLS_PER_PROMPT = 5
+
+
+def group_bills(items: List, size: int = MAX_BILLS_PER_PROMPT) -> List[List]:
+    """Split per-bill items into consecutive groups of at most size bills."""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def check_batch_size(results: List, expected: int, step: str) -> None:
+    """Ensure a batched LLM response returned one result per bill."""
+    if len(results) != expected:
+        logger.error(f"Batch {step} returned {len(results)} results for {expected} bills")
+        raise HTTPException(
+            status_code=502,
+            detail=f"Batch {step} returned {len(results)} results for {expected} bills.",
+        )
+
+
+async def extract_hcpcs_codes(payload: AnalyzeRequest) -> List[HCPCSCode]:
     logger.info("📋 Step 1: Extracting HCPCS codes from bill...")
     
     try:
-        result = client.beta.chat.completions.parse(
+        result = await client.beta.chat.completions.parse(
             model="gpt-5-mini",
             messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a medical coding assistant. Extract HCPCS/CPT codes from the "
-                        "provided bill text. HCPCS codes include CPT codes (numeric codes for procedures) "
-                        "and other codes for supplies, drugs, and services. Return null values when information is missing."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        "Bill text:\n"
-                        f"{payload.bill}\n\n"
-                        f"After-care summary: {payload.after_care_summary}"
-                    ),
-                },
+                {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+                {"role": "user", "content": format_extraction_input(payload)},
             ],
             response_format=HCPCSExtraction,
         )
@@ -282,36 +516,103 @@ def extract_hcpcs_codes(payload: AnalyzeRequest) -> List[HCPCSCode]:
     return parsed.codes
 
 
+async def extract_hcpcs_codes_batch(payloads: List[AnalyzeRequest]) -> List[List[HCPCSCode]]:
+    """Extract HCPCS codes for several bills with a single LLM call."""
+    logger.info(f"📋 Step 1: Extracting HCPCS codes from {len(payloads)} bills...")
+    
+    try:
+        result = await client.beta.chat.completions.parse(
+            model="gpt-5-mini",
+            messages=[
+                {"role": "system", "content": batch_system_prompt(EXTRACTION_SYSTEM_PROMPT, len(payloads))},
+                {"role": "user", "content": join_bill_sections([format_extraction_input(p) for p in payloads])},
+            ],
+            response_format=BatchExtraction,
+        )
+    except Exception as exc:
+        logger.error(f"Failed to extract HCPCS codes: {exc}")
+        raise HTTPException(status_code=502, detail=f"Failed to extract HCPCS codes: {exc}")
+
+    parsed = result.choices[0].message.parsed
+    if not parsed:
+        logger.error("Failed to parse HCPCS codes from response")
+        raise HTTPException(status_code=502, detail="Failed to parse HCPCS codes from response.")
+    check_batch_size(parsed.results, len(payloads), "extraction")
+    
+    logger.info(f"  ✓ Extracted {sum(len(r.codes) for r in parsed.results)} HCPCS codes")
+    return [r.codes for r in parsed.results]
+
+
+# Strips $, thousands separators and whitespace from charge strings
+_CHARGE_TBL = str.maketrans("", "", "$, \t\n")
+
+
+@functools.lru_cache(maxsize=1024)
 def parse_charge(charge_str: Optional[str]) -> float:
     """Parse a charge string like '$1,200' into a float."""
     if not charge_str:
         return 0.0
-    # Remove $ and commas, then convert to float
-    cleaned = charge_str.replace("$", "").replace(",", "").strip()
     try:
-        return float(cleaned)
+        charge = float(charge_str.translate(_CHARGE_TBL))
     except ValueError:
         return 0.0
+    # "inf"/"nan" parse as floats but are not charges
+    return charge if math.isfinite(charge) else 0.0
+
+
+@functools.lru_cache(maxsize=256)
+def parse_units(units_str: Optional[str]) -> int:
+    """Parse a units string like '2' or '3 units' into a whole number of units (at least 1)."""
+    match = re.search(r"\d+(?:\.\d+)?", units_str or "")
+    return max(int(float(match.group())), 1) if match else 1
 
 
 def detect_duplicates(codes: List[HCPCSCode]) -> Dict[str, int]:
     """Detect duplicate HCPCS codes and return occurrence counts."""
-    from collections import Counter
-    code_counts = Counter(hcpcs.code for hcpcs in codes)
+    code_counts: Dict[str, int] = {}
+    for hcpcs in codes:
+        code_counts[hcpcs.code] = code_counts.get(hcpcs.code, 0) + 1
     return {code: count for code, count in code_counts.items() if count > 1}
 
 
-def validate_medical_necessity(
-    payload: AnalyzeRequest, codes: List[HCPCSCode], duplicates: Dict[str, int]
-) -> ValidationResponse:
-    """Validate medical necessity with pre-fetched pricing data (single LLM call)."""
-    logger.info("🔬 Step 3: Pre-fetching pricing data and validating codes...")
+def prefetch_code_pricing(code: str, description: Optional[str], billed_charge: float) -> Tuple[Dict, List[Dict]]:
+    """Look up exact pricing and cheaper alternatives for a single billed code."""
+    # Look up exact code pricing
+    exact_lookup = lookup_hcpcs_code(code)
+    
+    # Search for similar cheaper alternatives (a code is never an alternative to itself)
+    similar_codes: List[Dict] = []
+    if exact_lookup.get("found") and description and billed_charge > 0:
+        similar_codes = [
+            alt for alt in find_similar_cheaper_codes(description, billed_charge)
+            if alt["code"] != code
+        ]
+    
+    return exact_lookup, similar_codes
+
+
+async def build_codes_with_pricing(codes: List[HCPCSCode], duplicates: Dict[str, int]) -> List[Dict]:
+    """Attach billed charges, duplicate warnings and database pricing to each code."""
+    billed_charges = [parse_charge(hcpcs.charge) for hcpcs in codes]
+    
+    # Duplicate lines share the same pricing, so fetch it once per unique
+    # (code, description, billed charge)
+    pricing_keys = [
+        (hcpcs.code, hcpcs.description, billed_charge)
+        for hcpcs, billed_charge in zip(codes, billed_charges)
+    ]
+    unique_keys = list(dict.fromkeys(pricing_keys))
+    
+    # Pre-fetch the pricing data concurrently; the DB work runs in worker
+    # threads so the event loop stays free for other requests
+    pricing = await asyncio.gather(*(
+        asyncio.to_thread(prefetch_code_pricing, *key) for key in unique_keys
+    ))
+    pricing_cache = dict(zip(unique_keys, pricing))
     
-    # Pre-fetch all pricing data for each code
     codes_with_pricing = []
-    for hcpcs in codes:
-        billed_charge = parse_charge(hcpcs.charge)
-        
+    for hcpcs, billed_charge, key in zip(codes, billed_charges, pricing_keys):
+        exact_lookup, similar_codes = pricing_cache[key]
         code_data = {
             "code": hcpcs.code,
             "description": hcpcs.description or "No description",
@@ -322,51 +623,160 @@ def validate_medical_necessity(
         
         # Check for duplicates
         if hcpcs.code in duplicates:
+            code_data["occurrences"] = duplicates[hcpcs.code]
             code_data["duplicate_warning"] = f"This code appears {duplicates[hcpcs.code]} times in the bill"
         
-        # Look up exact code pricing
-        exact_lookup = lookup_hcpcs_code(hcpcs.code)
         code_data["standard_pricing"] = exact_lookup
-        
-        # Search for similar cheaper alternatives
-        if exact_lookup.get("found") and hcpcs.description and billed_charge > 0:
-            similar_codes = find_similar_cheaper_codes(hcpcs.description, billed_charge)
-            if similar_codes:
-                code_data["cheaper_alternatives"] = similar_codes
+        if similar_codes:
+            code_data["cheaper_alternatives"] = similar_codes
         
         codes_with_pricing.append(code_data)
     
     logger.info(f"  ✓ Pre-fetched pricing data for {len(codes_with_pricing)} codes")
+    return codes_with_pricing
+
+
+# Billed charges above this multiple of the highest standard charge are treated as upcoding
+UPCODING_THRESHOLD = 2.0
+# Cheaper alternatives matching at least this many keywords are treated as a wrong code
+STRONG_MATCH_SCORE = 3
+
+
+def rule_validate(code_data: Dict) -> Optional[RuleValidation]:
+    """
+    Apply deterministic pricing and duplicate checks to a pre-fetched code.
+    Returns a disputed validation when a rule fires, or None when the code
+    needs a medical-necessity judgment from the LLM.
+    """
+    code = code_data["code"]
+    billed_charge = code_data["billed_charge"]
+    
+    # Upcoding: billed far above every standard charge for this code
+    standard_charge = code_data["standard_pricing"].get("max_gross_charge")
+    if standard_charge and billed_charge > UPCODING_THRESHOLD * standard_charge:
+        return RuleValidation(
+            code=code,
+            status="disputed",
+            reasoning=(
+                f"Billed charge of ${billed_charge:,.2f} is more than {UPCODING_THRESHOLD:g}x the "
+                f"highest UCSF standard charge of ${standard_charge:,.2f} for this code."
+            ),
+        )
+    
+    # Wrong code: billed above every standard charge for this code while a closely
+    # matching, cheaper code exists; a charge within the code's own standard range
+    # is left to the LLM even if an alternative matches
+    strong_alternatives = [
+        alt for alt in code_data.get("cheaper_alternatives", [])
+        if alt["match_score"] >= STRONG_MATCH_SCORE and alt["code"] != code
+    ]
+    if standard_charge and billed_charge > standard_charge and strong_alternatives:
+        alt = strong_alternatives[0]
+        return RuleValidation(
+            code=code,
+            status="disputed",
+            reasoning=(
+                f"Closely matching code {alt['code']} ({alt['description']}) has a standard charge of "
+                f"${alt['min_price']:,.2f}, below the billed ${billed_charge:,.2f}."
+            ),
+        )
+    
+    # Duplicate billing: the code appears on more lines than the units billed;
+    # only the lines beyond the billed units are disputed
+    occurrences = code_data.get("occurrences", 1)
+    expected_units = parse_units(code_data["units"])
+    if occurrences > expected_units:
+        return RuleValidation(
+            code=code,
+            status="disputed",
+            reasoning=(
+                f"Code is billed on {occurrences} separate lines but each line is for "
+                f"{expected_units} unit(s); the {occurrences - expected_units} extra line(s) "
+                f"are duplicate billing."
+            ),
+            accepted_lines=expected_units,
+        )
+    
+    return None
+
+
+def split_rule_validations(codes_with_pricing: List[Dict]) -> Tuple[List[RuleValidation], List[Dict]]:
+    """
+    Split pre-fetched codes into rule-based disputes and codes that still need the LLM.
+    Validations are per code: a code gets one rule validation, preferring a dispute of
+    every line over a duplicate dispute of some lines, and once any line of a code is
+    rule-disputed its other lines are not sent to the LLM either.
+    """
+    rule_validations: Dict[str, RuleValidation] = {}
+    unresolved: List[Dict] = []
+    for code_data in codes_with_pricing:
+        validation = rule_validate(code_data)
+        if not validation:
+            unresolved.append(code_data)
+            continue
+        current = rule_validations.get(validation.code)
+        if current is None or validation.accepted_lines < current.accepted_lines:
+            rule_validations[validation.code] = validation
+    
+    needs_llm = [code_data for code_data in unresolved if code_data["code"] not in rule_validations]
+    
+    logger.info(f"  ✓ Rules disputed {len(rule_validations)} codes, {len(needs_llm)} need LLM review")
+    return list(rule_validations.values()), needs_llm
+
+
+def merge_validations(
+    rule_validations: List[RuleValidation], llm_validation: Optional[ValidationResponse]
+) -> ValidationResponse:
+    """
+    Combine rule-based disputes with the LLM's validation of the remaining codes.
+    Rule disputes take precedence over any LLM result for the same code.
+    """
+    rule_summary = (
+        f"{len(rule_validations)} code(s) disputed by automated pricing and duplicate checks."
+        if rule_validations else ""
+    )
+    if llm_validation is None:
+        return ValidationResponse(
+            validations=rule_validations,
+            overall_reasoning=rule_summary or "No codes required review.",
+        )
+    
+    rule_disputed = {v.code for v in rule_validations}
+    return ValidationResponse(
+        validations=rule_validations + [
+            v for v in llm_validation.validations if v.code not in rule_disputed
+        ],
+        overall_reasoning=f"{rule_summary} {llm_validation.overall_reasoning}".strip(),
+    )
+
+
+async def validate_medical_necessity(
+    payload: AnalyzeRequest, codes: List[HCPCSCode], duplicates: Dict[str, int]
+) -> ValidationResponse:
+    """
+    Validate codes with pre-fetched pricing data. Deterministic rules handle clear
+    overcharges; only the remaining codes are sent to the LLM (single call).
+    """
+    logger.info("🔬 Step 3: Pre-fetching pricing data and validating codes...")
+    
+    codes_with_pricing = await build_codes_with_pricing(codes, duplicates)
+    rule_validations, needs_llm = split_rule_validations(codes_with_pricing)
+    
+    if not needs_llm:
+        logger.info(f"  ✓ Validation complete")
+        return merge_validations(rule_validations, None)
+    
     logger.info(f"  🤖 Calling LLM for single-pass validation...")
     
     try:
-        result = client.beta.chat.completions.parse(
-            model="gpt-4o",
+        result = await client.beta.chat.completions.parse(
+            model="gpt-4o-mini",
             messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a medical billing auditor analyzing HCPCS/CPT codes. "
-                        "Each code includes:\n"
-                        "1. Billed charge from the patient's bill\n"
-                        "2. Standard pricing from UCSF database (if available)\n"
-                        "3. Cheaper alternative codes with similar descriptions (if found)\n\n"
-                        "Your task:\n"
-                        "- Mark codes as 'disputed' if:\n"
-                        "  * Billed charge significantly exceeds standard charges (upcoding)\n"
-                        "  * A cheaper alternative with similar description exists (wrong code used)\n"
-                        "  * The code is duplicated inappropriately\n"
-                        "  * Medical necessity is questionable based on after-care summary\n"
-                        "- Mark codes as 'accepted' if they appear valid\n"
-                        "- Provide specific, factual reasoning citing prices and alternatives"
-                    ),
-                },
+                {"role": "system", "content": VALIDATION_SYSTEM_PROMPT},
                 {
                     "role": "user",
                     "content": (
-                        f"Bill text:\n{payload.bill}\n\n"
-                        f"After-care summary: {payload.after_care_summary or 'None provided'}\n\n"
-                        f"Codes with pricing data:\n{json.dumps(codes_with_pricing, indent=2)}\n\n"
+                        f"{format_validation_input(payload, needs_llm)}\n\n"
                         "Validate each code and explain your reasoning."
                     ),
                 },
@@ -386,61 +796,199 @@ def validate_medical_necessity(
         )
     
     logger.info(f"  ✓ Validation complete")
-    return parsed
+    return merge_validations(rule_validations, parsed)
+
+
+async def validate_medical_necessity_batch(
+    payloads: List[AnalyzeRequest],
+    codes_per_bill: List[List[HCPCSCode]],
+    duplicates_per_bill: List[Dict[str, int]]
+) -> List[ValidationResponse]:
+    """Validate the codes of several bills, sending all codes that need the LLM in a single call."""
+    logger.info(f"🔬 Step 3: Pre-fetching pricing data and validating codes for {len(payloads)} bills...")
+    
+    pricing_per_bill = await asyncio.gather(*(
+        build_codes_with_pricing(codes, duplicates)
+        for codes, duplicates in zip(codes_per_bill, duplicates_per_bill)
+    ))
+    rules_per_bill = [split_rule_validations(codes_with_pricing) for codes_with_pricing in pricing_per_bill]
+    
+    # Only bills with codes left after the rule checks go to the LLM
+    llm_bills = [index for index, (_, needs_llm) in enumerate(rules_per_bill) if needs_llm]
+    llm_validations: Dict[int, ValidationResponse] = {}
+    
+    if llm_bills:
+        logger.info(f"  🤖 Calling LLM for batched validation...")
+        
+        try:
+            result = await client.beta.chat.completions.parse(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": batch_system_prompt(VALIDATION_SYSTEM_PROMPT, len(llm_bills))},
+                    {
+                        "role": "user",
+                        "content": (
+                            join_bill_sections([
+                                format_validation_input(payloads[index], rules_per_bill[index][1])
+                                for index in llm_bills
+                            ])
+                            + "\n\nValidate each code of each bill and explain your reasoning."
+                        ),
+                    },
+                ],
+                response_format=BatchValidationResponse,
+            )
+        except Exception as exc:
+            logger.error(f"Failed to validate codes: {exc}")
+            raise HTTPException(
+                status_code=502, detail=f"Failed to validate medical necessity: {exc}"
+            )
+
+        parsed = result.choices[0].message.parsed
+        if not parsed:
+            raise HTTPException(
+                status_code=502, detail="Failed to parse validation response."
+            )
+        check_batch_size(parsed.results, len(llm_bills), "validation")
+        llm_validations = dict(zip(llm_bills, parsed.results))
+    
+    logger.info(f"  ✓ Validation complete")
+    return [
+        merge_validations(rule_validations, llm_validations.get(index))
+        for index, (rule_validations, _) in enumerate(rules_per_bill)
+    ]
+
+
+def build_code_analysis(
+    codes: List[HCPCSCode], validation: ValidationResponse
+) -> Tuple[List[CodeAnalysis], float]:
+    """Combine extracted codes with their validation results and total the disputed amount."""
+    codes_analysis: List[CodeAnalysis] = []
+    savings = 0.0
+    
+    # Create a mapping of code to validation result
+    validation_map = {v.code: v for v in validation.validations}
+    lines_seen: Dict[str, int] = {}
+    
+    # Process each code instance individually (no grouping)
+    for hcpcs in codes:
+        # Get validation result for this code
+        val = validation_map.get(hcpcs.code)
+        if not val:
+            # Fallback if validation didn't return this code
+            val = CodeValidation(
+                code=hcpcs.code,
+                status="accepted",
+                reasoning="No validation issues found."
+            )
+        
+        # Rule disputes may leave the first lines of a code accepted (e.g. duplicates)
+        line_index = lines_seen.get(hcpcs.code, 0)
+        lines_seen[hcpcs.code] = line_index + 1
+        if isinstance(val, RuleValidation) and line_index < val.accepted_lines:
+            val = CodeValidation(
+                code=hcpcs.code,
+                status="accepted",
+                reasoning="Billed units match this line; only the repeated lines are disputed."
+            )
+        
+        # Parse the charge
+        charge = parse_charge(hcpcs.charge)
+        
+        # If disputed, add to disputed amount
+        if val.status == "disputed":
+            savings += charge
+        
+        # Create analysis object for this individual instance
+        codes_analysis.append(CodeAnalysis(
+            code=hcpcs.code,
+            description=hcpcs.description,
+            revenue_code=hcpcs.revenue_code,
+            status=val.status,
+            reasoning=val.reasoning,
+            billed_charge=charge,
+        ))
+    
+    disputed_codes = [c for c in codes_analysis if c.status == "disputed"]
+    accepted_codes = [c for c in codes_analysis if c.status == "accepted"]
+    
+    logger.info(f"  ✓ Analysis complete:")
+    logger.info(f"    - {len(accepted_codes)} codes accepted")
+    logger.info(f"    - {len(disputed_codes)} codes disputed")
+    logger.info(f"    - ${savings:,.2f} in disputed charges")
+    
+    return codes_analysis, savings
 
 
-def draft_appeal_letter(
+NO_APPEAL_NEEDED = "No disputed charges found. No appeal letter is needed."
+
+
+async def stream_appeal_letter(
     payload: AnalyzeRequest,
     codes_analysis: List[CodeAnalysis],
     overall_reasoning: str,
     disputed_amount: float
-) -> str:
-    """Use LLM to draft a professional appeal letter based on validation results."""
+) -> AsyncIterator[str]:
+    """Use LLM to draft a professional appeal letter, yielding text chunks as they are generated."""
     disputed_codes = [c for c in codes_analysis if c.status == "disputed"]
     
     if not disputed_codes:
-        return "No disputed charges found. No appeal letter is needed."
+        yield NO_APPEAL_NEEDED
+        return
     
-    # Prepare disputed codes information
-    disputed_info = []
-    for code in disputed_codes:
-        disputed_info.append({
-            "code": code.code,
-            "description": code.description,
-            "charge": code.billed_charge,
-            "reasoning": code.reasoning
-        })
+    stream = await client.chat.completions.create(
+        model="gpt-5-mini",
+        messages=[
+            {"role": "system", "content": APPEAL_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": (
+                    f"{format_appeal_input(payload, disputed_codes, overall_reasoning, disputed_amount)}\n\n"
+                    "Draft a complete appeal letter ready to send to the billing department."
+                ),
+            },
+        ],
+        stream=True,
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def draft_appeal_letters_batch(
+    payloads: List[AnalyzeRequest],
+    analyses: List[Tuple[List[CodeAnalysis], float]],
+    validations: List[ValidationResponse]
+) -> List[str]:
+    """Draft appeal letters for every bill with disputed codes using a single LLM call."""
+    appeal_drafts = [NO_APPEAL_NEEDED] * len(payloads)
+    
+    # Only bills with disputed codes need a letter
+    sections = []
+    disputed_bills = []
+    for index, (payload, (codes_analysis, savings), validation) in enumerate(zip(payloads, analyses, validations)):
+        disputed_codes = [c for c in codes_analysis if c.status == "disputed"]
+        if disputed_codes:
+            sections.append(format_appeal_input(payload, disputed_codes, validation.overall_reasoning, savings))
+            disputed_bills.append(index)
+    
+    if not disputed_bills:
+        return appeal_drafts
     
     try:
-        result = client.beta.chat.completions.parse(
+        result = await client.beta.chat.completions.parse(
             model="gpt-5-mini",
             messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a professional medical billing advocate drafting an appeal letter.\n\n"
-                        "Draft a formal, professional appeal letter that:\n"
-                        "- Is addressed to the billing department\n"
-                        "- Clearly identifies the patient and bill details from the provided bill\n"
-                        "- Lists each disputed code with specific, factual reasoning\n"
-                        "- Requests formal review and adjustment of the disputed charges\n"
-                        "- Maintains a professional, respectful, yet firm tone\n"
-                        "- Cites medical billing standards and regulations where appropriate\n"
-                        "- Includes a clear call to action and contact information placeholder"
-                    ),
-                },
+                {"role": "system", "content": batch_system_prompt(APPEAL_SYSTEM_PROMPT, len(sections))},
                 {
                     "role": "user",
                     "content": (
-                        f"Bill text:\n{payload.bill}\n\n"
-                        f"After-care summary: {payload.after_care_summary or 'None provided'}\n\n"
-                        f"Overall analysis: {overall_reasoning}\n\n"
-                        f"Disputed codes ({len(disputed_codes)} total, ${disputed_amount:,.2f}):\n{disputed_info}\n\n"
-                        "Draft a complete appeal letter ready to send to the billing department."
+                        join_bill_sections(sections)
+                        + "\n\nDraft a complete appeal letter for each bill, ready to send to the billing department."
                     ),
                 },
             ],
-            response_format=AppealDraftResponse,
+            response_format=BatchAppealDraftResponse,
         )
     except Exception as exc:
         raise HTTPException(
@@ -452,18 +1000,214 @@ def draft_appeal_letter(
         raise HTTPException(
             status_code=502, detail="Failed to parse appeal draft response."
         )
+    check_batch_size(parsed.appeal_drafts, len(sections), "appeal drafting")
+    
+    for index, appeal_draft in zip(disputed_bills, parsed.appeal_drafts):
+        appeal_drafts[index] = appeal_draft
+    return appeal_drafts
+
+
+async def submit_extraction_batch_job(payloads: List[AnalyzeRequest]) -> str:
+    """
+    Submit HCPCS extraction for each bill to the OpenAI Batch API.
+    Results are produced offline (24h completion window) at a lower token rate;
+    returns the batch id to poll with GET /bill/analyze_batch/{batch_id}. The bills
+    are uploaded alongside so the remaining steps can run once extraction completes.
+    """
+    logger.info(f"📦 Submitting {len(payloads)} bills to the OpenAI Batch API...")
+    
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {"name": "HCPCSExtraction", "schema": HCPCSExtraction.model_json_schema()},
+    }
+    requests = [
+        orjson.dumps({
+            "custom_id": f"bill-{index}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": "gpt-5-mini",
+                "messages": [
+                    {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+                    {"role": "user", "content": format_extraction_input(payload)},
+                ],
+                "response_format": response_format,
+            },
+        })
+        for index, payload in enumerate(payloads)
+    ]
+    
+    try:
+        payloads_file = await client.files.create(
+            file=("bills.json", orjson.dumps([p.model_dump() for p in payloads])),
+            purpose="user_data",
+        )
+        batch_file = await client.files.create(
+            file=("hcpcs_extraction.jsonl", b"\n".join(requests)),
+            purpose="batch",
+        )
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"payloads_file_id": payloads_file.id},
+        )
+    except Exception as exc:
+        logger.error(f"Failed to submit batch job: {exc}")
+        raise HTTPException(status_code=502, detail=f"Failed to submit batch job: {exc}")
+    
+    logger.info(f"  ✓ Submitted batch job {batch.id}")
+    return batch.id
+
+
+# OpenAI Batch API statuses of a job that may still complete
+BATCH_PENDING_STATUSES = {"validating", "in_progress", "finalizing"}
+
+# Analysis of each completed batch job by batch id, so later polls return the same
+# results instead of re-running (and re-billing) the LLM steps; a job's files are
+# deleted once analyzed, so this process is the only place its results remain
+BATCH_ANALYSES: TTLCache = TTLCache(maxsize=256, ttl=24 * 3600)
+
+
+async def delete_batch_files(batch) -> None:
+    """Delete the uploaded bills and every input/output file of a batch job, since they contain patient data."""
+    file_ids = [
+        (batch.metadata or {}).get("payloads_file_id"),
+        batch.input_file_id,
+        batch.output_file_id,
+        batch.error_file_id,
+    ]
+    file_ids = [file_id for file_id in file_ids if file_id]
+    results = await asyncio.gather(
+        *(client.files.delete(file_id) for file_id in file_ids), return_exceptions=True
+    )
+    for file_id, result in zip(file_ids, results):
+        if isinstance(result, Exception) and not isinstance(result, NotFoundError):
+            logger.warning(f"Failed to delete file {file_id} of batch job {batch.id}: {result}")
+    logger.info(f"  ✓ Deleted {len(file_ids)} files of batch job {batch.id}")
+
+
+async def read_extraction_batch_output(batch) -> Tuple[List[AnalyzeRequest], List[List[HCPCSCode]]]:
+    """Download the bills and extracted HCPCS codes of a completed extraction batch job."""
+    payloads_file_id = (batch.metadata or {}).get("payloads_file_id")
+    if not payloads_file_id:
+        raise HTTPException(status_code=400, detail=f"Batch job {batch.id} was not submitted by /bill/analyze_batch.")
+    
+    try:
+        payloads_file = await client.files.content(payloads_file_id)
+        output_file = await client.files.content(batch.output_file_id)
+    except NotFoundError:
+        raise HTTPException(
+            status_code=410, detail=f"Results of batch job {batch.id} were already collected and its files deleted."
+        )
+    except Exception as exc:
+        logger.error(f"Failed to download batch job results: {exc}")
+        raise HTTPException(status_code=502, detail=f"Failed to download batch job results: {exc}")
+    
+    payloads = [AnalyzeRequest.model_validate(p) for p in orjson.loads(payloads_file.content)]
+    codes_per_bill: List[Optional[List[HCPCSCode]]] = [None] * len(payloads)
+    for line in output_file.content.splitlines():
+        if not line:
+            continue
+        record = orjson.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        index = int(record["custom_id"].removeprefix("bill-"))
+        content = response["body"]["choices"][0]["message"]["content"]
+        try:
+            codes_per_bill[index] = HCPCSExtraction.model_validate_json(content).codes
+        except ValidationError as exc:
+            logger.warning(f"Could not parse extraction for bill {index} of batch job {batch.id}: {exc}")
     
-    return parsed.appeal_draft
+    # Failed requests are written to the batch's error file instead of the output;
+    # the job's output won't change, so its files are not kept for a retry
+    missing = [index for index, codes in enumerate(codes_per_bill) if codes is None]
+    if missing:
+        logger.error(f"Batch job {batch.id} has no extraction results for bills {missing}")
+        await delete_batch_files(batch)
+        raise HTTPException(status_code=502, detail=f"Batch job {batch.id} has no extraction results for bills {missing}.")
+    
+    logger.info(f"  ✓ Read {sum(len(codes) for codes in codes_per_bill)} HCPCS codes from batch job {batch.id}")
+    return payloads, codes_per_bill
+
+
+def ndjson_event(event: Dict) -> bytes:
+    return orjson.dumps(event, option=orjson.OPT_APPEND_NEWLINE)
 
 
-@app.post("/bill/analyze", response_model=AnalyzeResponse)
-def analyze_bill(payload: AnalyzeRequest) -> AnalyzeResponse:
+def analyze_cache_key(payload: AnalyzeRequest) -> bytes:
+    """Content hash of the inputs that determine an analysis."""
+    return hashlib.blake2b(
+        orjson.dumps([payload.bill, payload.after_care_summary]), digest_size=16
+    ).digest()
+
+
+async def stream_analysis(
+    payload: AnalyzeRequest,
+    codes_analysis: List[CodeAnalysis],
+    savings: float,
+    overall_reasoning: str,
+    cache_key: Optional[bytes] = None
+) -> AsyncIterator[bytes]:
+    """
+    Emit the analysis as NDJSON: an "analysis" event with the codes, savings and
+    reasoning, then "appeal_draft_delta" events as the appeal letter is generated.
+    Failures after the stream has started are reported as an "error" event.
+    With a cache_key, a complete stream is cached for replay (appeal letter as one delta).
+    """
+    analysis_event = ndjson_event({
+        "type": "analysis",
+        "codes": [c.model_dump() for c in codes_analysis],
+        "savings": savings,
+        "overall_reasoning": overall_reasoning,
+    })
+    yield analysis_event
+    
+    # Step 5: Draft appeal letter based on validation results
+    logger.info("✍️  Step 5: Drafting appeal letter...")
+    appeal_parts: List[str] = []
+    try:
+        async for delta in stream_appeal_letter(payload, codes_analysis, overall_reasoning, savings):
+            appeal_parts.append(delta)
+            yield ndjson_event({"type": "appeal_draft_delta", "delta": delta})
+    except Exception as exc:
+        logger.error(f"Failed to draft appeal letter: {exc}")
+        yield ndjson_event({"type": "error", "detail": f"Failed to draft appeal letter: {exc}"})
+        return
+    appeal_draft = "".join(appeal_parts)
+    logger.info(f"  ✓ Appeal letter drafted ({len(appeal_draft)} characters)")
+    
+    if cache_key is not None:
+        ANALYZE_CACHE[cache_key] = analysis_event + ndjson_event(
+            {"type": "appeal_draft_delta", "delta": appeal_draft}
+        )
+    
+    logger.info("=" * 80)
+    logger.info("✅ Medical bill analysis complete!")
+    logger.info("=" * 80)
+
+
+@app.post("/bill/analyze")
+async def analyze_bill(payload: AnalyzeRequest) -> Response:
+    """
+    Analyze a bill and stream the result as NDJSON (see stream_analysis), so the
+    code analysis arrives before the appeal letter has finished generating.
+    Bills analyzed within the last hour are answered from ANALYZE_CACHE.
+    """
+    cache_key = analyze_cache_key(payload) if ANALYZE_CACHE_ENABLED else None
+    if cache_key is not None:
+        cached = ANALYZE_CACHE.get(cache_key)
+        if cached is not None:
+            logger.info("♻️  Returning cached analysis for a previously analyzed bill")
+            return Response(content=cached, media_type="application/x-ndjson")
+    
     logger.info("=" * 80)
     logger.info("🏥 Starting medical bill analysis...")
     logger.info("=" * 80)
     
     # Step 1: Extract HCPCS codes from bill
-    codes = extract_hcpcs_codes(payload)
+    codes = await extract_hcpcs_codes(payload)
     
     # Step 2: Detect duplicates
     logger.info("🔍 Step 2: Checking for duplicate codes...")
@@ -474,71 +1218,149 @@ def analyze_bill(payload: AnalyzeRequest) -> AnalyzeResponse:
         logger.info(f"  ✓ No duplicates found")
     
     # Step 3: Validate medical necessity with LLM (includes function calling for HCPCS lookups)
-    validation = validate_medical_necessity(payload, codes, duplicates)
+    validation = await validate_medical_necessity(payload, codes, duplicates)
     
     # Step 4: Build CodeAnalysis objects and calculate disputed amount
     logger.info("💰 Step 4: Building analysis results...")
-    codes_analysis: List[CodeAnalysis] = []
-    savings = 0.0
+    codes_analysis, savings = build_code_analysis(codes, validation)
     
-    # Create a mapping of code to validation result
-    validation_map = {v.code: v for v in validation.validations}
+    # Step 5-6: Stream the analysis followed by the appeal letter
+    return StreamingResponse(
+        stream_analysis(payload, codes_analysis, savings, validation.overall_reasoning, cache_key),
+        media_type="application/x-ndjson",
+    )
+
+
+async def analyze_extracted_bills(
+    payloads: List[AnalyzeRequest], codes_per_bill: List[List[HCPCSCode]]
+) -> List[AnalyzeResponse]:
+    """
+    Run steps 2-5 of the batched analysis, with one LLM call per step, on a group of
+    at most MAX_BILLS_PER_PROMPT bills whose HCPCS codes are extracted.
+    """
+    # Step 2: Detect duplicates within each bill
+    logger.info("🔍 Step 2: Checking for duplicate codes...")
+    duplicates_per_bill = [detect_duplicates(codes) for codes in codes_per_bill]
     
-    # Process each code instance individually (no grouping)
-    for hcpcs in codes:
-        # Get validation result for this code
-        val = validation_map.get(hcpcs.code)
-        if not val:
-            # Fallback if validation didn't return this code
-            val = CodeValidation(
-                code=hcpcs.code,
-                status="accepted",
-                reasoning="No validation issues found."
-            )
-        
-        # Parse the charge
-        charge = parse_charge(hcpcs.charge)
-        
-        # If disputed, add to disputed amount
-        if val.status == "disputed":
-            savings += charge
-        
-        # Create analysis object for this individual instance
-        codes_analysis.append(CodeAnalysis(
-            code=hcpcs.code,
-            description=hcpcs.description,
-            revenue_code=hcpcs.revenue_code,
-            status=val.status,
-            reasoning=val.reasoning,
-            billed_charge=charge,
-        ))
+    # Step 3: Validate medical necessity for all bills
+    validations = await validate_medical_necessity_batch(payloads, codes_per_bill, duplicates_per_bill)
     
-    disputed_codes = [c for c in codes_analysis if c.status == "disputed"]
-    accepted_codes = [c for c in codes_analysis if c.status == "accepted"]
+    # Step 4: Build CodeAnalysis objects per bill
+    logger.info("💰 Step 4: Building analysis results...")
+    analyses = [
+        build_code_analysis(codes, validation)
+        for codes, validation in zip(codes_per_bill, validations)
+    ]
     
-    logger.info(f"  ✓ Analysis complete:")
-    logger.info(f"    - {len(accepted_codes)} codes accepted")
-    logger.info(f"    - {len(disputed_codes)} codes disputed")
-    logger.info(f"    - ${savings:,.2f} in disputed charges")
+    # Step 5: Draft appeal letters for bills with disputed codes
+    logger.info("✍️  Step 5: Drafting appeal letters...")
+    appeal_drafts = await draft_appeal_letters_batch(payloads, analyses, validations)
     
-    # Step 5: Draft appeal letter based on validation results
-    logger.info("✍️  Step 5: Drafting appeal letter...")
-    appeal_draft = draft_appeal_letter(
-        payload=payload,
-        codes_analysis=codes_analysis,
-        overall_reasoning=validation.overall_reasoning,
-        disputed_amount=savings
-    )
-    logger.info(f"  ✓ Appeal letter drafted ({len(appeal_draft)} characters)")
+    return [
+        AnalyzeResponse(
+            codes=codes_analysis,
+            savings=savings,
+            appeal_draft=appeal_draft,
+            overall_reasoning=validation.overall_reasoning,
+        )
+        for (codes_analysis, savings), appeal_draft, validation in zip(analyses, appeal_drafts, validations)
+    ]
+
+
+@app.post("/bill/analyze_batch", response_model=AnalyzeBatchResponse)
+async def analyze_bill_batch(
+    payloads: List[AnalyzeRequest], use_batch_api: bool = False
+) -> AnalyzeBatchResponse:
+    """
+    Analyze several bills with one LLM call per pipeline step.
+    With use_batch_api, extraction is submitted to the OpenAI Batch API for
+    offline processing and only the batch id is returned; poll it with
+    GET /bill/analyze_batch/{batch_id} to get the results.
+    """
+    if not payloads:
+        raise HTTPException(status_code=400, detail="At least one bill is required.")
     
-    # Step 6: Return complete analysis with appeal draft
+    if use_batch_api:
+        batch_id = await submit_extraction_batch_job(payloads)
+        return AnalyzeBatchResponse(batch_id=batch_id)
+    
+    groups = group_bills(payloads)
     logger.info("=" * 80)
-    logger.info("✅ Medical bill analysis complete!")
+    logger.info(f"🏥 Starting batched analysis of {len(payloads)} medical bills in {len(groups)} group(s)...")
+    logger.info("=" * 80)
+    
+    async def analyze_group(group: List[AnalyzeRequest]) -> List[AnalyzeResponse]:
+        # Step 1: Extract HCPCS codes from the group's bills
+        codes_per_bill = await extract_hcpcs_codes_batch(group)
+        return await analyze_extracted_bills(group, codes_per_bill)
+    
+    # The groups run through the pipeline concurrently
+    grouped_results = await asyncio.gather(*(analyze_group(group) for group in groups))
+    
+    logger.info("=" * 80)
+    logger.info("✅ Batched medical bill analysis complete!")
+    logger.info("=" * 80)
+    
+    return AnalyzeBatchResponse(results=[result for results in grouped_results for result in results])
+
+
+async def finish_batch_analysis(batch) -> AnalyzeBatchResponse:
+    """Run the remaining pipeline steps on a completed extraction batch job."""
+    logger.info("=" * 80)
+    logger.info(f"🏥 Continuing batched analysis from batch job {batch.id}...")
+    logger.info("=" * 80)
+    
+    # Step 1: Read the HCPCS codes extracted by the batch job
+    payloads, codes_per_bill = await read_extraction_batch_output(batch)
+    
+    grouped_results = await asyncio.gather(*(
+        analyze_extracted_bills(group, group_codes)
+        for group, group_codes in zip(group_bills(payloads), group_bills(codes_per_bill))
+    ))
+    results = [result for results in grouped_results for result in results]
+    
+    logger.info("=" * 80)
+    logger.info("✅ Batched medical bill analysis complete!")
     logger.info("=" * 80)
     
-    return AnalyzeResponse(
-        codes=codes_analysis,
-        savings=savings,
-        appeal_draft=appeal_draft,
-        overall_reasoning=validation.overall_reasoning,
-    )
\ No newline at end of file
+    # The bills are no longer needed once analyzed; don't leave them in OpenAI file storage
+    await delete_batch_files(batch)
+    
+    return AnalyzeBatchResponse(results=results, batch_id=batch.id, batch_status=batch.status)
+
+
+@app.get("/bill/analyze_batch/{batch_id}", response_model=AnalyzeBatchResponse)
+async def get_analyze_batch(batch_id: str) -> AnalyzeBatchResponse:
+    """
+    Poll an extraction job submitted with use_batch_api. While it is running only
+    its status is returned; once complete, the remaining steps run on its output
+    once and later polls get the same results from BATCH_ANALYSES.
+    """
+    analysis = BATCH_ANALYSES.get(batch_id)
+    if analysis is None:
+        try:
+            batch = await client.batches.retrieve(batch_id)
+        except NotFoundError:
+            raise HTTPException(status_code=404, detail=f"Batch job {batch_id} not found.")
+        except Exception as exc:
+            logger.error(f"Failed to retrieve batch job: {exc}")
+            raise HTTPException(status_code=502, detail=f"Failed to retrieve batch job: {exc}")
+        
+        if batch.status in BATCH_PENDING_STATUSES:
+            return AnalyzeBatchResponse(batch_id=batch_id, batch_status=batch.status)
+        if batch.status != "completed" or not batch.output_file_id:
+            await delete_batch_files(batch)
+            raise HTTPException(status_code=502, detail=f"Batch job {batch_id} ended with status '{batch.status}'.")
+        
+        # Concurrent polls share one analysis task
+        analysis = asyncio.ensure_future(finish_batch_analysis(batch))
+        BATCH_ANALYSES[batch_id] = analysis
+    
+    try:
+        # Shielded so a poll that disconnects doesn't cancel the shared analysis
+        return await asyncio.shield(analysis)
+    except Exception:
+        # Forget failed analyses so a later poll can retry
+        if BATCH_ANALYSES.get(batch_id) is analysis:
+            del BATCH_ANALYSES[batch_id]
+        raise
@@ -0,0 +1,27 @@
+"""
+Gunicorn settings for running the backend with several workers:
+
+    uv run gunicorn app.main:app
+
+The app is imported once in the master before forking (preload_app), so the HCPCS
+index is loaded a single time and every worker shares its pages copy-on-write
+instead of holding its own copy.
+"""
+import gc
+import os
+
+bind = os.environ.get("BACKEND_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn_worker.UvicornWorker"
+timeout = 300
+
+# Load app.main (and with it the HCPCS index) in the master before forking.
+# Nothing may start threads at import time, since threads do not survive the fork.
+preload_app = True
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's generations so
+    # collections in the workers do not write to (and un-share) those pages
+    gc.freeze()
+    server.log.info("Froze preloaded objects before forking workers")
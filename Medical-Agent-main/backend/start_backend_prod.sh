@@ -0,0 +1,8 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+# Ensure we run from the backend directory so module import paths resolve
+cd "$(dirname "$0")"
+
+# Multiple workers sharing one preloaded HCPCS index (see gunicorn.conf.py)
+exec uv run gunicorn app.main:app -c gunicorn.conf.py
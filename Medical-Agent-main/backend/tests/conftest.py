@@ -0,0 +1,5 @@
+import os
+
+# app.main creates the OpenAI client at import time; tests never call the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ANALYZE_CACHE_ENABLED", "false")
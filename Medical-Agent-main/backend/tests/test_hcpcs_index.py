@@ -0,0 +1,25 @@
+import pickle
+
+from app.hcpcs_index import INDEX_VERSION, load_prebuilt_hcpcs_index
+
+
+def test_missing_index_is_ignored(tmp_path):
+    assert load_prebuilt_hcpcs_index(tmp_path / "hcpcs_index.pkl", tmp_path / "charges.json") is None
+
+
+def test_corrupt_index_is_ignored(tmp_path):
+    index_path = tmp_path / "hcpcs_index.pkl"
+    index_path.write_bytes(b"not a pickle")
+    assert load_prebuilt_hcpcs_index(index_path, tmp_path / "charges.json") is None
+
+
+def test_index_that_is_not_a_dict_is_ignored(tmp_path):
+    index_path = tmp_path / "hcpcs_index.pkl"
+    index_path.write_bytes(pickle.dumps([INDEX_VERSION]))
+    assert load_prebuilt_hcpcs_index(index_path, tmp_path / "charges.json") is None
+
+
+def test_current_index_is_loaded(tmp_path):
+    index_path = tmp_path / "hcpcs_index.pkl"
+    index_path.write_bytes(pickle.dumps({'version': INDEX_VERSION}))
+    assert load_prebuilt_hcpcs_index(index_path, tmp_path / "charges.json") == {'version': INDEX_VERSION}
@@ -0,0 +1,97 @@
+import pytest
+
+from app.main import (
+    HCPCS_DATABASE,
+    CodeValidation,
+    HCPCSCode,
+    ValidationResponse,
+    build_code_analysis,
+    find_similar_cheaper_codes,
+    merge_validations,
+    parse_charge,
+    parse_units,
+    prefetch_code_pricing,
+    rule_validate,
+    split_rule_validations,
+)
+
+PRICED_CODES = [code for code, entry in HCPCS_DATABASE.items() if entry['max_price'] is not None]
+
+
+def code_data_at_standard_price(code: str) -> dict:
+    """Pre-fetched code data for a code billed at its highest standard charge, with its own description."""
+    entry = HCPCS_DATABASE[code]
+    exact_lookup, similar_codes = prefetch_code_pricing(code, entry['description'], entry['max_price'])
+    return {
+        "code": code,
+        "description": entry['description'],
+        "billed_charge": entry['max_price'],
+        "units": "1",
+        "revenue_code": entry['revenue_code'],
+        "standard_pricing": exact_lookup,
+        "cheaper_alternatives": similar_codes,
+    }
+
+
+@pytest.mark.skipif(not PRICED_CODES, reason="UCSF standard charges data not available")
+def test_code_billed_at_standard_price_is_not_rule_disputed():
+    disputed = [code for code in PRICED_CODES if rule_validate(code_data_at_standard_price(code))]
+    assert disputed == []
+
+
+@pytest.mark.skipif("10060" not in HCPCS_DATABASE, reason="UCSF standard charges data not available")
+def test_code_is_not_its_own_cheaper_alternative():
+    code_data = code_data_at_standard_price("10060")
+    assert all(alt["code"] != "10060" for alt in code_data["cheaper_alternatives"])
+
+
+def test_rule_dispute_takes_precedence_over_llm_for_same_code():
+    lines = [
+        {"code": "99285", "billed_charge": 100_000.0, "units": "2",
+         "standard_pricing": {"max_gross_charge": 11901.0}},
+        {"code": "99285", "billed_charge": 11901.0, "units": "2",
+         "standard_pricing": {"max_gross_charge": 11901.0}},
+    ]
+    rule_validations, needs_llm = split_rule_validations(lines)
+    assert needs_llm == []
+
+    llm_validation = ValidationResponse(
+        validations=[CodeValidation(code="99285", status="accepted", reasoning="Medically necessary.")],
+        overall_reasoning="",
+    )
+    merged = merge_validations(rule_validations, llm_validation)
+    codes, _ = build_code_analysis(
+        [HCPCSCode(code="99285", charge="100000"), HCPCSCode(code="99285", charge="11901")], merged
+    )
+    assert [c.status for c in codes] == ["disputed", "disputed"]
+
+
+def test_duplicate_rule_disputes_only_the_extra_lines():
+    line = {"code": "36415", "billed_charge": 40.0, "units": "1", "occurrences": 2,
+            "standard_pricing": {"max_gross_charge": 40.0}}
+    rule_validations, needs_llm = split_rule_validations([line, dict(line)])
+    assert len(rule_validations) == 1
+    assert needs_llm == []
+
+    merged = merge_validations(rule_validations, None)
+    codes, savings = build_code_analysis(
+        [HCPCSCode(code="36415", charge="$40"), HCPCSCode(code="36415", charge="$40")], merged
+    )
+    assert [c.status for c in codes] == ["accepted", "disputed"]
+    assert savings == 40.0
+    assert merged.overall_reasoning.startswith("1 code(s) disputed")
+
+
+@pytest.mark.parametrize("units, expected", [("1", 1), ("2", 2), ("3 units", 3), ("2.0", 2), ("", 1), (None, 1), ("0", 1)])
+def test_parse_units(units, expected):
+    assert parse_units(units) == expected
+
+
+@pytest.mark.parametrize("charge", ["Infinity", "1e400", "nan"])
+def test_non_finite_charge_is_not_a_price(charge):
+    assert parse_charge(charge) == 0.0
+
+
+def test_similar_code_search_ignores_non_finite_price():
+    assert find_similar_cheaper_codes("Emergency department visit high severity", float("inf")) == []
+    assert find_similar_cheaper_codes("Emergency department visit high severity", float("nan")) == []
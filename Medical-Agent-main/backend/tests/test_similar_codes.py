@@ -0,0 +1,14 @@
+import numpy as np
+
+from app.main import top_k_by_score_and_price
+
+
+def test_top_k_matches_full_sort_with_ties():
+    rng = np.random.default_rng(0)
+    for _ in range(2000):
+        n = int(rng.integers(0, 60))
+        scores = rng.integers(2, 5, n).astype(np.int32)
+        prices = rng.integers(1, 6, n).astype(np.float64)
+        k = int(rng.integers(1, 8))
+        expected = np.lexsort((prices, -scores))[:k]
+        assert top_k_by_score_and_price(scores, prices, k).tolist() == expected.tolist()
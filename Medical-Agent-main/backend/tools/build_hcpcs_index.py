@@ -0,0 +1,32 @@
+"""
+Pre-build the HCPCS index so the backend can skip parsing the UCSF JSON at startup.
+
+Run from the backend directory whenever assets/ucsf_standard_charges.json changes:
+
+    uv run python -m tools.build_hcpcs_index
+"""
+import logging
+import time
+
+from app.hcpcs_index import INDEX_PATH, JSON_PATH, build_hcpcs_index_from_json, save_hcpcs_index
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    start = time.perf_counter()
+    logger.info(f"Building HCPCS index from {JSON_PATH}")
+    index = build_hcpcs_index_from_json()
+    save_hcpcs_index(index)
+    logger.info(
+        f"✓ Wrote {len(index['database'])} HCPCS codes to {INDEX_PATH} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
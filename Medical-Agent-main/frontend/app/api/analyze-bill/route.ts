@@ -42,10 +42,13 @@ export async function POST(request: NextRequest) {
       throw new Error(`Backend analysis failed: ${errorText}`)
     }
 
-    const analysisResult = await backendResponse.json()
-    console.log("✅ Backend analysis complete!")
+    console.log("✅ Backend analysis started, streaming results...")
 
-    return NextResponse.json(analysisResult)
+    // Pass the NDJSON stream straight through so the page can render the code
+    // analysis before the appeal letter has finished generating
+    return new Response(backendResponse.body, {
+      headers: { "Content-Type": "application/x-ndjson" },
+    })
   } catch (error) {
     console.error("❌ Error processing files:", error)
     return NextResponse.json(
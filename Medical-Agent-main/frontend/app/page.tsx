@@ -32,11 +32,48 @@ interface BackendCodeAnalysis {
   billed_charge: number
 }
 
-interface BackendAnalysisResponse {
-  codes: BackendCodeAnalysis[]
-  savings: number
-  appeal_draft: string
-  overall_reasoning: string
+// The analysis is streamed as NDJSON: an "analysis" event with the codes, savings
+// and reasoning, then "appeal_draft_delta" events as the appeal letter is generated
+type AnalysisStreamEvent =
+  | {
+      type: "analysis"
+      codes: BackendCodeAnalysis[]
+      savings: number
+      overall_reasoning: string
+    }
+  | { type: "appeal_draft_delta"; delta: string }
+  | { type: "error"; detail: string }
+
+async function readAnalysisStream(
+  response: Response,
+  onEvent: (event: AnalysisStreamEvent) => void
+): Promise<void> {
+  if (!response.body) {
+    throw new Error("Analysis returned an empty response")
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ""
+
+  const handleLine = (line: string) => {
+    if (!line.trim()) return
+    const event: AnalysisStreamEvent = JSON.parse(line)
+    if (event.type === "error") {
+      throw new Error(`Backend analysis failed: ${event.detail}`)
+    }
+    onEvent(event)
+  }
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    const lines = buffer.split("\n")
+    buffer = lines.pop() ?? ""
+    lines.forEach(handleLine)
+  }
+  handleLine(buffer + decoder.decode())
 }
 
 export default function Home() {
@@ -65,33 +102,40 @@ export default function Home() {
         throw new Error("Failed to analyze files")
       }
 
-      const backendResult: BackendAnalysisResponse = await response.json()
-
-      // Map backend response to frontend format
-      const cptCodes: CPTCode[] = backendResult.codes.map((code) => ({
-        code: code.code,
-        description: code.description || "No description available",
-        status: code.status === "disputed" ? "incorrect" : "correct",
-        amount: code.billed_charge,
-        reason: code.reasoning,
-      }))
-
-      // Calculate total billed
-      const totalBilled = backendResult.codes.reduce(
-        (sum, code) => sum + code.billed_charge,
-        0
-      )
-
-      const analysisData: AnalysisData = {
-        cptCodes,
-        totalBilled,
-        potentialSavings: backendResult.savings,
-        insurancePlan: plan,
-        appealDraft: backendResult.appeal_draft,
-        overallReasoning: backendResult.overall_reasoning,
-      }
-
-      setAnalysisData(analysisData)
+      await readAnalysisStream(response, (event) => {
+        if (event.type === "analysis") {
+          // Map backend response to frontend format
+          const cptCodes: CPTCode[] = event.codes.map((code) => ({
+            code: code.code,
+            description: code.description || "No description available",
+            status: code.status === "disputed" ? "incorrect" : "correct",
+            amount: code.billed_charge,
+            reason: code.reasoning,
+          }))
+
+          // Calculate total billed
+          const totalBilled = event.codes.reduce(
+            (sum, code) => sum + code.billed_charge,
+            0
+          )
+
+          // Show the results right away; the appeal letter fills in as it streams
+          setAnalysisData({
+            cptCodes,
+            totalBilled,
+            potentialSavings: event.savings,
+            insurancePlan: plan,
+            appealDraft: "",
+            overallReasoning: event.overall_reasoning,
+          })
+          setIsAnalyzing(false)
+        } else if (event.type === "appeal_draft_delta") {
+          const { delta } = event
+          setAnalysisData((current) =>
+            current && { ...current, appealDraft: current.appealDraft + delta }
+          )
+        }
+      })
     } catch (error) {
       console.error("❌ Error analyzing bill:", error)
       alert("Failed to analyze bill. Please try again.")